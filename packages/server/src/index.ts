@@ -89,11 +89,18 @@ app.post('/api/entry-point', async (c) => {
       return c.json({ error: 'Website not found' }, 404);
     }
 
-    // Search all chunks for this building
-    const chunks = await c.env.DB.prepare('SELECT chunk_x, chunk_z, data FROM chunks')
-      .all<{ chunk_x: number; chunk_z: number; data: string }>();
+    // Look up the chunk this building was placed in (placements is keyed by
+    // url) instead of scanning and parsing every cached chunk
+    const chunk = await c.env.DB.prepare(`
+      SELECT chunks.chunk_x, chunks.chunk_z, chunks.data
+      FROM placements
+      JOIN chunks ON chunks.chunk_x = placements.chunk_x AND chunks.chunk_z = placements.chunk_z
+      WHERE placements.url = ?
+    `)
+      .bind(url)
+      .first<{ chunk_x: number; chunk_z: number; data: string }>();
 
-    for (const chunk of chunks.results) {
+    if (chunk) {
       const chunkData: ChunkResponse = JSON.parse(chunk.data);
       const buildingIndex = chunkData.buildings.findIndex(b => b.url === url);
 
@@ -6,38 +6,58 @@
 // Toggle between mock (random unplaced sites) and real k-NN
 export const USE_MOCK_KNN = true;
 
-export interface Website {
-  url: string;
-  embedding: Float32Array;
+/**
+ * All embeddings packed into one contiguous row-major buffer
+ */
+export interface EmbeddingMatrix {
+  urls: string[];
+  vectors: Float32Array;
+  dim: number;
+  indexByUrl: Map<string, number>;
 }
 
 /**
- * Cosine similarity between two vectors
+ * Dot product of two vectors (cosine similarity when both are L2-normalized)
  */
-function cosineSimilarity(a: Float32Array, b: Float32Array): number {
+function dotProduct(a: Float32Array, b: Float32Array): number {
   let dot = 0;
-  let magA = 0;
-  let magB = 0;
 
   for (let i = 0; i < a.length; i++) {
     dot += a[i] * b[i];
-    magA += a[i] * a[i];
-    magB += b[i] * b[i];
   }
 
-  if (magA === 0 || magB === 0) return 0;
-  return dot / (Math.sqrt(magA) * Math.sqrt(magB));
+  return dot;
+}
+
+/**
+ * Scale a vector to unit length in place (zero vectors are left as-is)
+ */
+function normalizeInPlace(v: Float32Array): void {
+  let mag = 0;
+
+  for (let i = 0; i < v.length; i++) {
+    mag += v[i] * v[i];
+  }
+
+  if (mag === 0) return;
+
+  const inv = 1 / Math.sqrt(mag);
+  for (let i = 0; i < v.length; i++) {
+    v[i] *= inv;
+  }
 }
 
 /**
  * Cache for loaded embeddings (reused across requests)
  */
-let embeddingsCache: Website[] | null = null;
+let embeddingsCache: EmbeddingMatrix | null = null;
 
 /**
- * Load all embeddings into memory once
+ * Load all embeddings into memory once, copying each row into a single
+ * Float32Array instead of keeping one small typed array per website.
+ * Rows are L2-normalized here so queries only need a dot product.
  */
-async function loadAllEmbeddings(db: D1Database): Promise<Website[]> {
+async function loadAllEmbeddings(db: D1Database): Promise<EmbeddingMatrix> {
   if (embeddingsCache) {
     return embeddingsCache;
   }
@@ -46,12 +66,23 @@ async function loadAllEmbeddings(db: D1Database): Promise<Website[]> {
     .prepare('SELECT url, embedding FROM websites WHERE embedding IS NOT NULL')
     .all<{ url: string; embedding: ArrayBuffer }>();
 
-  embeddingsCache = results.results.map((row) => ({
-    url: row.url,
-    embedding: new Float32Array(row.embedding),
-  }));
+  const dim = results.results.length > 0 ? results.results[0].embedding.byteLength / 4 : 0;
+  const rows = results.results.filter((row) => row.embedding.byteLength === dim * 4);
+  const vectors = new Float32Array(rows.length * dim);
+
+  rows.forEach((row, i) => {
+    vectors.set(new Float32Array(row.embedding), i * dim);
+    normalizeInPlace(vectors.subarray(i * dim, (i + 1) * dim));
+  });
 
-  console.log(`Loaded ${embeddingsCache.length} embeddings into memory`);
+  embeddingsCache = {
+    urls: rows.map((row) => row.url),
+    vectors,
+    dim,
+    indexByUrl: new Map(rows.map((row, i) => [row.url, i])),
+  };
+
+  console.log(`Loaded ${rows.length} embeddings into memory`);
   return embeddingsCache;
 }
 
@@ -97,13 +128,11 @@ async function findSimilarWebsitesReal(
   anchorUrl: string,
   k: number
 ): Promise<string[]> {
-  // Get anchor embedding
-  const anchorRow = await db
-    .prepare('SELECT embedding FROM websites WHERE url = ?')
-    .bind(anchorUrl)
-    .first<{ embedding: ArrayBuffer }>();
+  // Load all embeddings (anchor is looked up from the cache, not the DB)
+  const { urls, vectors, dim, indexByUrl } = await loadAllEmbeddings(db);
+  const anchorIndex = indexByUrl.get(anchorUrl);
 
-  if (!anchorRow || !anchorRow.embedding) {
+  if (anchorIndex === undefined) {
     console.warn(`No embedding found for anchor: ${anchorUrl}`);
     // Return random websites as fallback
     const fallback = await db
@@ -113,23 +142,33 @@ async function findSimilarWebsitesReal(
     return fallback.results.map((r) => r.url);
   }
 
-  const anchorVec = new Float32Array(anchorRow.embedding);
+  const anchorVec = vectors.subarray(anchorIndex * dim, (anchorIndex + 1) * dim);
+
+  // Keep only the top-k (descending) while scanning instead of sorting
+  // every similarity; ties keep corpus order like the stable sort did
+  const topUrls: string[] = [];
+  const topScores: number[] = [];
 
-  // Load all embeddings
-  const allWebsites = await loadAllEmbeddings(db);
+  for (let i = 0; i < urls.length; i++) {
+    if (i === anchorIndex) continue; // Exclude anchor itself
 
-  // Compute similarities
-  const similarities = allWebsites
-    .filter((site) => site.url !== anchorUrl) // Exclude anchor itself
-    .map((site) => ({
-      url: site.url,
-      similarity: cosineSimilarity(anchorVec, site.embedding),
-    }));
+    // Cosine similarity, since rows are pre-normalized
+    const similarity = dotProduct(anchorVec, vectors.subarray(i * dim, (i + 1) * dim));
+    if (topScores.length === k && similarity <= topScores[k - 1]) continue;
 
-  // Sort by similarity (descending) and take top-k
-  similarities.sort((a, b) => b.similarity - a.similarity);
+    let pos = topScores.length;
+    while (pos > 0 && topScores[pos - 1] < similarity) pos--;
+
+    topScores.splice(pos, 0, similarity);
+    topUrls.splice(pos, 0, urls[i]);
+
+    if (topScores.length > k) {
+      topScores.pop();
+      topUrls.pop();
+    }
+  }
 
-  return similarities.slice(0, k).map((s) => s.url);
+  return topUrls;
 }
 
 /**
@@ -0,0 +1,53 @@
+/**
+ * Decode the float16 embedding side files written by modal_embeddings.py
+ */
+
+/**
+ * Convert an IEEE 754 half-precision value to a JS number
+ */
+function halfToFloat(h: number): number {
+  const sign = h & 0x8000 ? -1 : 1;
+  const exponent = (h >> 10) & 0x1f;
+  const fraction = h & 0x3ff;
+
+  if (exponent === 0) return sign * Math.pow(2, -14) * (fraction / 1024);
+  if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+  return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
+
+// Every half-precision bit pattern decoded once, so rows widen by table lookup
+const HALF_TO_FLOAT = new Float32Array(65536);
+for (let h = 0; h < 65536; h++) {
+  HALF_TO_FLOAT[h] = halfToFloat(h);
+}
+
+export interface EmbeddingRef {
+  url?: string;
+  domain?: string;         // Older import-to-sqlite-v2 inputs
+  embedding?: string;      // Hex-encoded float32 (older outputs)
+  embedding_row?: number;  // Row in the side .f16 file (float16, embedding_dim per row)
+  embedding_dim: number;
+}
+
+/**
+ * Get the float32 BLOB the server reads for one JSONL item
+ */
+export function deserializeEmbedding(item: EmbeddingRef, f16: Buffer | null): Buffer {
+  // Older outputs inline the float32 embedding as hex
+  if (item.embedding) {
+    return Buffer.from(item.embedding, 'hex');
+  }
+
+  if (!f16 || item.embedding_row === undefined) {
+    throw new Error(`No embedding found for ${item.url || item.domain}`);
+  }
+
+  // Widen the float16 row from the side file to float32
+  const dim = item.embedding_dim;
+  const offset = item.embedding_row * dim * 2;
+  const out = new Float32Array(dim);
+  for (let i = 0; i < dim; i++) {
+    out[i] = HALF_TO_FLOAT[f16.readUInt16LE(offset + i * 2)];
+  }
+  return Buffer.from(out.buffer, out.byteOffset, out.byteLength);
+}
@@ -6,6 +6,7 @@ import Database from 'better-sqlite3';
 import fs from 'fs';
 import path from 'path';
 import { fileURLToPath } from 'url';
+import { deserializeEmbedding } from './float16.js';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -33,16 +34,13 @@ interface EmbeddingData {
   confidence?: string;
 
   // Embedding
-  embedding: string;  // Hex-encoded binary
+  embedding?: string;      // Hex-encoded float32 (older outputs)
+  embedding_row?: number;  // Row in the side .f16 file (float16, embedding_dim per row)
   embedding_dim: number;
   embedding_model: string;
   timestamp: string;
 }
 
-function deserializeEmbedding(hexString: string): Buffer {
-  return Buffer.from(hexString, 'hex');
-}
-
 function calculatePopularityScore(rank: number, totalUrls: number): number {
   return 100 - (Math.log10(rank) / Math.log10(totalUrls)) * 100;
 }
@@ -67,6 +65,13 @@ async function importEmbeddings(inputFile: string, isSample: boolean = false) {
 
   const db = new Database(DB_PATH);
 
+  // Bulk-load settings: NORMAL sync so each batch commit doesn't fsync (the
+  // file is already in WAL mode from init-db.ts), and a larger page cache /
+  // in-memory temp store for the index updates
+  db.pragma('synchronous = NORMAL');
+  db.pragma('temp_store = MEMORY');
+  db.pragma('cache_size = -200000');
+
   // Prepare insert statement with new schema
   const insertStmt = db.prepare(`
     INSERT OR REPLACE INTO websites
@@ -93,7 +98,7 @@ async function importEmbeddings(inputFile: string, isSample: boolean = false) {
         item.primary_topics ? JSON.stringify(item.primary_topics) : null,
         item.tone || null,
         description || null,
-        deserializeEmbedding(item.embedding),
+        deserializeEmbedding(item, f16),
         item.embedding_dim,
         item.embedding_model,
         item.data_source || 'llm',
@@ -111,6 +116,10 @@ async function importEmbeddings(inputFile: string, isSample: boolean = false) {
 
   console.log(`Found ${items.length} embeddings`);
 
+  // Packed float16 embeddings written next to the JSONL by modal_embeddings.py
+  const f16File = inputFile.replace(/\.jsonl$/, '.f16');
+  const f16 = fs.existsSync(f16File) ? fs.readFileSync(f16File) : null;
+
   // Import in batches
   const batchSize = 1000;
   const batches = [];
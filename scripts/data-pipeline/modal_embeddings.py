@@ -4,9 +4,9 @@ Uses Sentence Transformers with all-MiniLM-L6-v2 model
 """
 
 import modal
-import json
-import struct
-from typing import List, Dict
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator, Tuple
 from datetime import datetime
 
 # Create Modal app
@@ -19,87 +19,153 @@ image = modal.Image.debian_slim().pip_install(
     "transformers==4.40.0"
 )
 
+# Texts per forward pass (A10G can handle large batches)
+ENCODE_BATCH_SIZE = 256
 
-@app.function(
+
+@app.cls(
     image=image,
     gpu="A10G",  # NVIDIA A10G - good price/performance
     timeout=3600,
     memory=16384  # 16 GB RAM
 )
-def generate_embeddings_batch(metadata_items: List[Dict]) -> List[Dict]:
-    """
-    Generate embeddings for a batch of website metadata
-    Returns metadata with embeddings attached
-    """
-    from sentence_transformers import SentenceTransformer
-    import torch
-
-    print(f"Loading model... (GPU: {torch.cuda.is_available()})")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-
-    if torch.cuda.is_available():
-        model = model.to('cuda')
-        print(f"Using GPU: {torch.cuda.get_device_name(0)}")
-    else:
-        print("WARNING: No GPU detected, using CPU")
-
-    # Prepare texts for embedding
-    texts = []
-    for item in metadata_items:
-        # Use semantic_description if available (from LLM profiler)
-        # Otherwise fall back to title + description (from scraper)
-        if 'semantic_description' in item:
-            text = item['semantic_description']
+class Embedder:
+    @modal.enter()
+    def load_model(self):
+        """Load model once when container starts"""
+        from sentence_transformers import SentenceTransformer
+        import torch
+
+        print(f"Loading model... (GPU: {torch.cuda.is_available()})")
+        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+
+        if torch.cuda.is_available():
+            # fp16 weights: half the memory traffic and Tensor Core matmuls;
+            # output is stored as float16 anyway
+            self.model = self.model.to('cuda').half()
+            print(f"Using GPU: {torch.cuda.get_device_name(0)}")
         else:
-            text = f"{item.get('title', item['domain'])}. {item.get('description', '')}"
-        texts.append(text)
-
-    print(f"Generating embeddings for {len(texts)} items...")
-
-    # Generate embeddings (GPU accelerated)
-    embeddings = model.encode(
-        texts,
-        batch_size=256,  # A10G can handle large batches
-        show_progress_bar=False,
-        normalize_embeddings=True,  # For cosine similarity
-        convert_to_numpy=True
-    )
-
-    print(f"Embeddings generated: shape={embeddings.shape}")
-
-    # Attach embeddings to metadata
-    results = []
-    for item, embedding in zip(metadata_items, embeddings):
-        # Serialize embedding to binary format (saves space)
-        embedding_binary = serialize_embedding(embedding.tolist())
-
-        results.append({
-            'url': item['url'],
-            'title': item['title'],
-            'description': item['description'],
-            'embedding': embedding_binary.hex(),  # Hex string for JSON transport
-            'embedding_dim': len(embedding),
-            'embedding_model': 'all-MiniLM-L6-v2',
-            'timestamp': datetime.utcnow().isoformat()
-        })
-
-    return results
-
+            print("WARNING: No GPU detected, using CPU")
+
+        # One tokenizer thread reused across calls: HF fast tokenizers release
+        # the GIL, so the next batch tokenizes while the GPU encodes the current
+        # one, without forking worker processes per call
+        self.tokenize = functools.partial(
+            self.model.tokenizer,
+            padding=True,
+            truncation=True,
+            max_length=self.model.max_seq_length,
+            return_tensors='pt'
+        )
+        self.tokenizer_pool = ThreadPoolExecutor(max_workers=1)
+
+    @modal.exit()
+    def shutdown(self):
+        """Stop the tokenizer thread when the container shuts down"""
+        self.tokenizer_pool.shutdown(wait=False)
+
+    @modal.method()
+    def generate_embeddings_batch(self, metadata_items: List[Dict]) -> Tuple[List[Dict], bytes]:
+        """
+        Generate embeddings for a batch of website metadata
+        Returns metadata records plus the embeddings as packed float16 rows
+        (same order), to be appended to the side .f16 file
+        """
+        import numpy as np
+        import torch
+
+        # Prepare texts for embedding
+        texts = []
+        for item in metadata_items:
+            # Use semantic_description if available (from LLM profiler)
+            # Otherwise fall back to title + description (from scraper)
+            if 'semantic_description' in item:
+                text = item['semantic_description']
+            else:
+                text = f"{item.get('title', item['domain'])}. {item.get('description', '')}"
+            texts.append(text)
+
+        print(f"Generating embeddings for {len(texts)} items...")
+
+        # Sort by length (longest first, as model.encode does) so each batch
+        # pads to similar lengths; outputs are scattered back to input order
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        sorted_texts = [texts[i] for i in order]
+        batches = [
+            sorted_texts[i:i + ENCODE_BATCH_SIZE]
+            for i in range(0, len(sorted_texts), ENCODE_BATCH_SIZE)
+        ]
+
+        # Generate embeddings (GPU accelerated), tokenizing one batch ahead
+        device = self.model.device
+        outputs = []
+        with torch.inference_mode():
+            pending = self.tokenizer_pool.submit(self.tokenize, batches[0])
+            for i in range(len(batches)):
+                features = pending.result()
+                if i + 1 < len(batches):
+                    pending = self.tokenizer_pool.submit(self.tokenize, batches[i + 1])
+
+                features = {k: v.to(device) for k, v in features.items()}
+                output = self.model(features)['sentence_embedding']
+                # Normalize on the GPU, for cosine similarity
+                outputs.append(torch.nn.functional.normalize(output, dim=1))
+
+        sorted_embeddings = torch.cat(outputs).cpu().numpy()
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+
+        print(f"Embeddings generated: shape={embeddings.shape}")
+
+        # Metadata records; embeddings travel separately as raw float16
+        results = []
+        for item, embedding in zip(metadata_items, embeddings):
+            results.append({
+                'url': item['url'],
+                'title': item['title'],
+                'description': item['description'],
+                'embedding_dim': len(embedding),
+                'embedding_model': 'all-MiniLM-L6-v2',
+                'timestamp': datetime.utcnow().isoformat()
+            })
+
+        return results, embeddings.astype(np.float16).tobytes()
+
+
+def iter_batches(input_file: str, batch_size: int) -> Iterator[List[Dict]]:
+    """Stream usable items from a JSONL file in fixed-size batches"""
+    import orjson
+
+    batch = []
+    with open(input_file, 'rb') as f:
+        for line in f:
+            item = orjson.loads(line)
+            # For scraped metadata, only process successful scrapes
+            if 'status' in item and item['status'] != 'success':
+                continue
+            # For LLM profiles, skip errors
+            if item.get('category') == 'Error':
+                continue
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
 
-def serialize_embedding(embedding: List[float]) -> bytes:
-    """Pack embedding as binary (4 bytes per float)"""
-    return struct.pack(f'{len(embedding)}f', *embedding)
+    if batch:
+        yield batch
 
 
 @app.local_entrypoint()
 def embed_sample():
     """Generate embeddings for sample dataset"""
     import os
+    import orjson
 
     # Try profiles first (LLM-generated), fall back to scraped metadata
     profiles_file = "scripts/data-pipeline/output/profiles-with-descriptions-sample.jsonl"
     metadata_file = "scripts/data-pipeline/output/metadata-sample.jsonl"
     output_file = "scripts/data-pipeline/output/embeddings-sample.jsonl"
+    embeddings_file = "scripts/data-pipeline/output/embeddings-sample.f16"
 
     input_file = None
     if os.path.exists(profiles_file):
@@ -114,58 +180,53 @@ def embed_sample():
         return
 
     print(f"Reading from {input_file}...")
-    metadata_items = []
-    with open(input_file, 'r') as f:
-        for line in f:
-            item = json.loads(line)
-            # For scraped metadata, only process successful scrapes
-            if 'status' in item and item['status'] != 'success':
-                continue
-            # For LLM profiles, skip errors
-            if item.get('category') == 'Error':
-                continue
-            metadata_items.append(item)
+    print("Generating embeddings with Modal GPU...")
 
-    print(f"Loaded {len(metadata_items)} items")
+    # Stream batches of 1000 (fits in GPU memory) straight from the input file
+    # and write each result as it arrives, so the driver never holds the
+    # whole dataset in memory
+    batches = iter_batches(input_file, batch_size=1000)
 
-    if not metadata_items:
+    count = 0
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, 'wb', buffering=1 << 20) as f, \
+            open(embeddings_file, 'wb', buffering=1 << 20) as f_bin:
+        for i, (batch_results, batch_embeddings) in enumerate(Embedder().generate_embeddings_batch.map(batches)):
+            for result in batch_results:
+                # Row index into the .f16 file (embedding_dim float16 values per row)
+                result['embedding_row'] = count
+                count += 1
+                f.write(orjson.dumps(result))
+                f.write(b'\n')
+            f_bin.write(batch_embeddings)
+            print(f"  Batch {i+1} complete")
+
+    if count == 0:
+        # Don't leave empty outputs behind for the importers to choke on
+        os.remove(output_file)
+        os.remove(embeddings_file)
         print("No successful scrapes found!")
         return
 
-    # Process in batches of 1000 (fits in GPU memory)
-    batch_size = 1000
-    batches = [metadata_items[i:i+batch_size] for i in range(0, len(metadata_items), batch_size)]
-
-    print(f"Generating embeddings with Modal GPU ({len(batches)} batches)...")
-
-    all_results = []
-    for i, batch_results in enumerate(generate_embeddings_batch.map(batches)):
-        all_results.extend(batch_results)
-        print(f"  Batch {i+1}/{len(batches)} complete")
-
-    # Write results
-    print(f"Writing embeddings to {output_file}...")
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, 'w') as f:
-        for result in all_results:
-            f.write(json.dumps(result) + '\n')
-
     print(f"\nDone!")
-    print(f"  Generated embeddings: {len(all_results)}")
+    print(f"  Generated embeddings: {count}")
     print(f"  Embedding dimension: 384")
     print(f"  Model: all-MiniLM-L6-v2")
     print(f"  Output: {output_file}")
+    print(f"  Embeddings: {embeddings_file} (float16)")
 
 
 @app.local_entrypoint()
 def embed_full():
     """Generate embeddings for full dataset"""
     import os
+    import orjson
 
     # Try profiles first (LLM-generated), fall back to scraped metadata
     profiles_file = "scripts/data-pipeline/output/profiles-with-descriptions-full.jsonl"
     metadata_file = "scripts/data-pipeline/output/metadata-full.jsonl"
     output_file = "scripts/data-pipeline/output/embeddings-full.jsonl"
+    embeddings_file = "scripts/data-pipeline/output/embeddings-full.f16"
 
     input_file = None
     if os.path.exists(profiles_file):
@@ -180,46 +241,39 @@ def embed_full():
         return
 
     print(f"Reading from {input_file}...")
-    metadata_items = []
-    with open(input_file, 'r') as f:
-        for line in f:
-            item = json.loads(line)
-            # For scraped metadata, only process successful scrapes
-            if 'status' in item and item['status'] != 'success':
-                continue
-            # For LLM profiles, skip errors
-            if item.get('category') == 'Error':
-                continue
-            metadata_items.append(item)
-
-    print(f"Loaded {len(metadata_items)} items")
-
-    if not metadata_items:
-        print("No successful scrapes found!")
-        return
-
-    # Process in batches of 1000 (fits in GPU memory)
-    batch_size = 1000
-    batches = [metadata_items[i:i+batch_size] for i in range(0, len(metadata_items), batch_size)]
-
-    print(f"Generating embeddings with Modal GPU ({len(batches)} batches)...")
+    print("Generating embeddings with Modal GPU...")
     print("This will take ~10-15 minutes...")
 
-    all_results = []
-    for i, batch_results in enumerate(generate_embeddings_batch.map(batches)):
-        all_results.extend(batch_results)
-        if (i + 1) % 10 == 0:
-            print(f"  Processed {len(all_results)}/{len(metadata_items)} items...")
+    # Stream batches of 1000 (fits in GPU memory) straight from the input file
+    # and write each result as it arrives, so the driver never holds the
+    # whole dataset in memory
+    batches = iter_batches(input_file, batch_size=1000)
 
-    # Write results
-    print(f"Writing embeddings to {output_file}...")
+    count = 0
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, 'w') as f:
-        for result in all_results:
-            f.write(json.dumps(result) + '\n')
+    with open(output_file, 'wb', buffering=1 << 20) as f, \
+            open(embeddings_file, 'wb', buffering=1 << 20) as f_bin:
+        for i, (batch_results, batch_embeddings) in enumerate(Embedder().generate_embeddings_batch.map(batches)):
+            for result in batch_results:
+                # Row index into the .f16 file (embedding_dim float16 values per row)
+                result['embedding_row'] = count
+                count += 1
+                f.write(orjson.dumps(result))
+                f.write(b'\n')
+            f_bin.write(batch_embeddings)
+            if (i + 1) % 10 == 0:
+                print(f"  Processed {count} items...")
+
+    if count == 0:
+        # Don't leave empty outputs behind for the importers to choke on
+        os.remove(output_file)
+        os.remove(embeddings_file)
+        print("No successful scrapes found!")
+        return
 
     print(f"\nDone!")
-    print(f"  Generated embeddings: {len(all_results)}")
+    print(f"  Generated embeddings: {count}")
     print(f"  Embedding dimension: 384")
     print(f"  Model: all-MiniLM-L6-v2")
     print(f"  Output: {output_file}")
+    print(f"  Embeddings: {embeddings_file} (float16)")
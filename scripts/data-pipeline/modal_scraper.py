@@ -5,11 +5,9 @@ Scrapes title and description from websites in parallel
 
 import modal
 import asyncio
-import json
 from datetime import datetime
 from typing import List, Dict
 import aiohttp
-from bs4 import BeautifulSoup
 
 # Create Modal app
 app = modal.App("website-scraper")
@@ -17,50 +15,91 @@ app = modal.App("website-scraper")
 # Define image with dependencies
 image = modal.Image.debian_slim().pip_install(
     "aiohttp==3.9.1",
-    "beautifulsoup4==4.12.2",
-    "lxml==4.9.3"
+    "selectolax==0.3.21"
 )
 
+# Stop reading a page body after this many bytes (title/meta live in <head>)
+MAX_HTML_BYTES = 64 * 1024
 
-@app.function(
+
+@app.cls(
     image=image,
     cpu=2,
     timeout=600,
     retries=2,
     concurrency_limit=50  # 50 parallel workers
 )
-async def scrape_batch(urls: List[str]) -> List[Dict]:
-    """Scrape metadata from a batch of URLs"""
-    results = []
-
-    # Configure aiohttp with reasonable timeouts and limits
-    timeout = aiohttp.ClientTimeout(total=10, connect=5)
-    connector = aiohttp.TCPConnector(limit_per_host=10, limit=100)
-
-    async with aiohttp.ClientSession(
-        timeout=timeout,
-        connector=connector,
-        headers={
-            'User-Agent': 'Mozilla/5.0 (compatible; 3DNeighborhoodBot/1.0; Research)'
-        }
-    ) as session:
-        tasks = [scrape_single_url(session, url) for url in urls]
+class Scraper:
+    @modal.enter()
+    async def open_session(self):
+        """Create one HTTP session per container so DNS and connections are reused across batches"""
+        # Configure aiohttp with reasonable timeouts and limits
+        timeout = aiohttp.ClientTimeout(total=10, connect=5)
+        connector = aiohttp.TCPConnector(
+            limit_per_host=10,
+            limit=100,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True
+        )
+
+        self.session = aiohttp.ClientSession(
+            timeout=timeout,
+            connector=connector,
+            headers={
+                'User-Agent': 'Mozilla/5.0 (compatible; 3DNeighborhoodBot/1.0; Research)'
+            }
+        )
+
+    @modal.exit()
+    async def close_session(self):
+        """Close the shared session when the container shuts down"""
+        await self.session.close()
+
+    @modal.method()
+    async def scrape_batch(self, urls: List[str]) -> List[Dict]:
+        """Scrape metadata from a batch of URLs"""
+        tasks = [scrape_single_url(self.session, url) for url in urls]
         results = await asyncio.gather(*tasks, return_exceptions=True)
 
-    # Process results, handling exceptions
-    processed_results = []
-    for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            processed_results.append({
-                'url': urls[i],
-                'status': 'failed',
-                'error': str(result),
-                'timestamp': datetime.utcnow().isoformat()
-            })
-        else:
-            processed_results.append(result)
+        # Process results, handling exceptions
+        processed_results = []
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                processed_results.append({
+                    'url': urls[i],
+                    'status': 'failed',
+                    'error': str(result),
+                    'timestamp': datetime.utcnow().isoformat()
+                })
+            else:
+                processed_results.append(result)
+
+        return processed_results
+
 
-    return processed_results
+async def read_html_until(response: aiohttp.ClientResponse, buf: bytearray, marker: bytes):
+    """Stream the body into buf until marker appears or MAX_HTML_BYTES is read"""
+    while marker not in buf.lower() and len(buf) < MAX_HTML_BYTES:
+        chunk = await response.content.read(8192)
+        if not chunk:
+            break
+        buf.extend(chunk)
+
+
+def parse_html(response: aiohttp.ClientResponse, buf: bytearray):
+    """
+    Parse a (possibly truncated) body, decoding it like response.text() would:
+    the Content-Type charset if present, else sniffed from <meta charset> or
+    the bytes themselves
+    """
+    from selectolax.parser import HTMLParser
+
+    if response.charset:
+        try:
+            return HTMLParser(buf.decode(response.charset, errors='replace'))
+        except LookupError:
+            pass
+    return HTMLParser(bytes(buf), detect_encoding=True, use_meta_tags=True)
 
 
 async def scrape_single_url(session: aiohttp.ClientSession, url: str) -> Dict:
@@ -79,39 +118,37 @@ async def scrape_single_url(session: aiohttp.ClientSession, url: str) -> Dict:
                     'timestamp': datetime.utcnow().isoformat()
                 }
 
-            # Read content
-            html = await response.text()
-            soup = BeautifulSoup(html, 'lxml')
+            # Read content only up to </head>, where title/meta tags live
+            buf = bytearray()
+            await read_html_until(response, buf, b'</head>')
+            # selectolax (Lexbor, C) instead of building a full BS4 tree
+            tree = parse_html(response, buf)
 
             # Extract title
-            title_tag = soup.find('title')
-            title = title_tag.get_text().strip() if title_tag else url
+            title_tag = tree.css_first('title')
+            title = title_tag.text().strip() if title_tag else url
 
-            # Extract description (try multiple meta tags)
+            # Extract description (try multiple meta tags, first hit wins)
             description = None
-
-            # Try standard meta description
-            desc_tag = soup.find('meta', attrs={'name': 'description'})
-            if desc_tag and desc_tag.get('content'):
-                description = desc_tag.get('content').strip()
-
-            # Try og:description
-            if not description:
-                og_desc = soup.find('meta', attrs={'property': 'og:description'})
-                if og_desc and og_desc.get('content'):
-                    description = og_desc.get('content').strip()
-
-            # Try twitter:description
-            if not description:
-                tw_desc = soup.find('meta', attrs={'name': 'twitter:description'})
-                if tw_desc and tw_desc.get('content'):
-                    description = tw_desc.get('content').strip()
+            for selector in (
+                'meta[name="description"]',
+                'meta[property="og:description"]',
+                'meta[name="twitter:description"]',
+            ):
+                desc_tag = tree.css_first(selector)
+                content = (desc_tag.attributes.get('content') or '').strip() if desc_tag else ''
+                if content:
+                    description = content
+                    break
 
             # Fallback to first paragraph if no meta description
             if not description:
-                first_p = soup.find('p')
+                # Only now read past <head>, up to the first paragraph
+                await read_html_until(response, buf, b'</p>')
+                tree = parse_html(response, buf)
+                first_p = tree.css_first('p')
                 if first_p:
-                    description = first_p.get_text().strip()[:500]
+                    description = first_p.text().strip()[:500]
 
             # Ultimate fallback: use title
             if not description:
@@ -145,6 +182,8 @@ async def scrape_single_url(session: aiohttp.ClientSession, url: str) -> Dict:
 def scrape_sample():
     """Scrape a sample of 1000 URLs for testing"""
     import os
+    import itertools
+    import orjson
 
     # Read URLs from Tranco list
     input_file = "scripts/data-pipeline/output/tranco-top-1m.csv"
@@ -156,25 +195,31 @@ def scrape_sample():
 
     print("Reading URLs from Tranco list...")
     with open(input_file, 'r') as f:
-        urls = [line.strip().split(',')[1] for line in f.readlines()[:1000]]
+        # Only read the first 1000 lines, not the whole 1M-row file
+        urls = [line.strip().split(',')[1] for line in itertools.islice(f, 1000)]
 
     print(f"Scraping {len(urls)} URLs with Modal...")
 
+    # Group related hosts (same registrable domain / subdomains) into the same
+    # batch so a worker's lookups for them hit the session's DNS cache
+    urls.sort(key=lambda u: tuple(reversed(u.split('.'))))
+
     # Split into batches of 100
     batch_size = 100
     batches = [urls[i:i+batch_size] for i in range(0, len(urls), batch_size)]
 
     # Process batches in parallel
     all_results = []
-    for results in scrape_batch.map(batches):
+    for results in Scraper().scrape_batch.map(batches):
         all_results.extend(results)
 
     # Write results
     print(f"Writing results to {output_file}...")
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, 'w') as f:
+    with open(output_file, 'wb', buffering=1 << 20) as f:
         for result in all_results:
-            f.write(json.dumps(result) + '\n')
+            f.write(orjson.dumps(result))
+            f.write(b'\n')
 
     # Print stats
     successful = sum(1 for r in all_results if r['status'] == 'success')
@@ -189,6 +234,7 @@ def scrape_sample():
 def scrape_full():
     """Scrape full 1M URLs"""
     import os
+    import orjson
 
     input_file = "scripts/data-pipeline/output/tranco-top-1m.csv"
     output_file = "scripts/data-pipeline/output/metadata-full.jsonl"
@@ -199,17 +245,21 @@ def scrape_full():
 
     print("Reading URLs from Tranco list...")
     with open(input_file, 'r') as f:
-        urls = [line.strip().split(',')[1] for line in f.readlines()]
+        urls = [line.strip().split(',')[1] for line in f]
 
     print(f"Scraping {len(urls)} URLs with Modal (this will take ~10-15 minutes)...")
 
+    # Group related hosts (same registrable domain / subdomains) into the same
+    # batch so a worker's lookups for them hit the session's DNS cache
+    urls.sort(key=lambda u: tuple(reversed(u.split('.'))))
+
     # Split into batches of 100
     batch_size = 100
     batches = [urls[i:i+batch_size] for i in range(0, len(urls), batch_size)]
 
     # Process batches in parallel
     all_results = []
-    for i, results in enumerate(scrape_batch.map(batches)):
+    for i, results in enumerate(Scraper().scrape_batch.map(batches)):
         all_results.extend(results)
         if (i + 1) % 100 == 0:
             print(f"  Processed {(i+1)*batch_size}/{len(urls)} URLs...")
@@ -217,9 +267,10 @@ def scrape_full():
     # Write results
     print(f"Writing results to {output_file}...")
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, 'w') as f:
+    with open(output_file, 'wb', buffering=1 << 20) as f:
         for result in all_results:
-            f.write(json.dumps(result) + '\n')
+            f.write(orjson.dumps(result))
+            f.write(b'\n')
 
     # Print stats
     successful = sum(1 for r in all_results if r['status'] == 'success')
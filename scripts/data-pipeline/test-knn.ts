@@ -21,58 +21,81 @@ interface Website {
   embedding: Buffer;
 }
 
-function deserializeEmbedding(blob: Buffer): number[] {
-  const floatArray: number[] = [];
-  for (let i = 0; i < blob.length; i += 4) {
-    floatArray.push(blob.readFloatLE(i));
-  }
-  return floatArray;
+interface Corpus {
+  urls: string[];
+  titles: string[];
+  vectors: Float32Array;  // Row-major, L2-normalized
+  dim: number;
+  indexByUrl: Map<string, number>;
 }
 
-function cosineSimilarity(a: number[], b: number[]): number {
-  if (a.length !== b.length) {
-    throw new Error('Vectors must have same length');
-  }
+/**
+ * Load every embedding once into a single normalized matrix so each query
+ * is a plain dot-product scan instead of re-reading and re-decoding the table
+ */
+function loadCorpus(db: Database.Database): Corpus {
+  const rows = db.prepare('SELECT url, title, embedding FROM websites WHERE embedding IS NOT NULL').all() as Website[];
+  const dim = rows.length > 0 ? rows[0].embedding.length / 4 : 0;
+  const vectors = new Float32Array(rows.length * dim);
+  const indexByUrl = new Map<string, number>();
+
+  rows.forEach((row, r) => {
+    const offset = r * dim;
+    let norm = 0;
+    for (let i = 0; i < dim; i++) {
+      const v = row.embedding.readFloatLE(i * 4);
+      vectors[offset + i] = v;
+      norm += v * v;
+    }
 
-  let dotProduct = 0;
-  let normA = 0;
-  let normB = 0;
+    norm = Math.sqrt(norm);
+    if (norm > 0) {
+      for (let i = 0; i < dim; i++) {
+        vectors[offset + i] /= norm;
+      }
+    }
 
-  for (let i = 0; i < a.length; i++) {
-    dotProduct += a[i] * b[i];
-    normA += a[i] * a[i];
-    normB += b[i] * b[i];
-  }
+    indexByUrl.set(row.url, r);
+  });
 
-  return dotProduct / (Math.sqrt(normA) * Math.sqrt(normB));
+  return {
+    urls: rows.map(row => row.url),
+    titles: rows.map(row => row.title || row.url),
+    vectors,
+    dim,
+    indexByUrl,
+  };
 }
 
-function findSimilar(db: Database.Database, queryUrl: string, k: number = 15): Array<{url: string, title: string, similarity: number}> {
-  // Get query embedding
-  const queryWebsite = db.prepare('SELECT embedding FROM websites WHERE url = ?').get(queryUrl) as Website | undefined;
+function findSimilar(corpus: Corpus, queryUrl: string, k: number = 15): Array<{url: string, title: string, similarity: number}> {
+  const queryIndex = corpus.indexByUrl.get(queryUrl);
 
-  if (!queryWebsite) {
+  if (queryIndex === undefined) {
     console.log(`Website not found: ${queryUrl}`);
     return [];
   }
 
-  const queryEmbedding = deserializeEmbedding(queryWebsite.embedding);
+  const { vectors, dim } = corpus;
+  const queryOffset = queryIndex * dim;
 
-  // Get all websites
-  const allWebsites = db.prepare('SELECT url, title, embedding FROM websites').all() as Website[];
+  // Cosine similarity reduces to a dot product on normalized vectors
+  const similarities: Array<{url: string, title: string, similarity: number}> = [];
+  for (let r = 0; r < corpus.urls.length; r++) {
+    if (r === queryIndex) continue;
 
-  // Calculate similarities
-  const similarities = allWebsites.map(site => ({
-    url: site.url,
-    title: site.title,
-    similarity: cosineSimilarity(queryEmbedding, deserializeEmbedding(site.embedding))
-  }));
+    const offset = r * dim;
+    let dot = 0;
+    for (let i = 0; i < dim; i++) {
+      dot += vectors[queryOffset + i] * vectors[offset + i];
+    }
+
+    similarities.push({ url: corpus.urls[r], title: corpus.titles[r], similarity: dot });
+  }
 
   // Sort by similarity (descending) and return top k
   return similarities
     .sort((a, b) => b.similarity - a.similarity)
-    .slice(0, k + 1)  // +1 because query itself will be included
-    .filter(s => s.url !== queryUrl);  // Remove query from results
+    .slice(0, k);
 }
 
 function testKNN() {
@@ -90,6 +113,8 @@ function testKNN() {
   }
 
   const db = new Database(DB_PATH, { readonly: true });
+  const corpus = loadCorpus(db);
+  console.log(`Loaded ${corpus.urls.length} embeddings\n`);
 
   // Test cases: various well-known websites
   const testCases = [
@@ -102,9 +127,7 @@ function testKNN() {
 
   for (const testUrl of testCases) {
     // Check if URL exists
-    const exists = db.prepare('SELECT COUNT(*) as count FROM websites WHERE url = ?').get(testUrl) as { count: number };
-
-    if (exists.count === 0) {
+    if (!corpus.indexByUrl.has(testUrl)) {
       console.log(`⚠ Skipping ${testUrl} (not in database)\n`);
       continue;
     }
@@ -112,7 +135,7 @@ function testKNN() {
     console.log(`Query: ${testUrl}`);
     console.log('─'.repeat(60));
 
-    const similar = findSimilar(db, testUrl, 10);
+    const similar = findSimilar(corpus, testUrl, 10);
 
     if (similar.length === 0) {
       console.log('  No results found');
@@ -145,7 +168,7 @@ function testKNN() {
     console.log(`Random site: ${site.url} - ${site.title}`);
     console.log('Nearest neighbors:');
 
-    const neighbors = findSimilar(db, site.url, 5);
+    const neighbors = findSimilar(corpus, site.url, 5);
     neighbors.forEach((neighbor, i) => {
       const simPercent = (neighbor.similarity * 100).toFixed(1);
       console.log(`  ${i + 1}. ${neighbor.url} (${simPercent}%)`);